@@ -3,40 +3,76 @@ Ruokalista - JSON recipe manager with meal planning.
 """
 import json
 import os
-from flask import Flask, render_template, request, redirect, url_for, flash, Response
+import time
+from flask import Flask, render_template, request, redirect, url_for, flash, Response, g, session, make_response, jsonify
 from pathlib import Path
 from datetime import date, timedelta
+from functools import lru_cache
+from collections import defaultdict
 
-from recipes import load_all_recipes, load_recipe, save_recipe, recipe_to_dict, all_ingredients, format_amount
+from recipes import (
+    recipes_snapshot, refresh_recipes, start_recipe_watcher, load_recipe, get_recipe_path, save_recipe,
+    recipe_to_dict, all_ingredients, format_amount
+)
 from models import (
     get_week_start, get_week_dates, get_all_templates, get_template, create_template,
     delete_template, update_template_name, get_template_meals, add_template_meal, remove_template_meal,
     get_or_create_active_week, apply_template_to_week, get_week_meals,
     add_week_meal, update_week_meal, remove_week_meal, toggle_meal_done, get_undone_meals,
-    get_all_weeks
+    get_all_weeks, init_db
 )
-from git_sync import sync, get_status
+from git_sync import start_sync, get_sync_status, get_status
 
 app = Flask(__name__)
 app.secret_key = 'change-this-in-production'
 
 RECIPES_PATH = Path(__file__).parent / "reseptit"
+SLUG_TRANS = str.maketrans({' ': '-', 'ä': 'a', 'ö': 'o', 'å': 'a'})
 DAYS_FI = ['Maanantai', 'Tiistai', 'Keskiviikko', 'Torstai', 'Perjantai', 'Lauantai', 'Sunnuntai']
 
 # Configuration from environment
 CHEFS = [c.strip() for c in os.environ.get('CHEFS', '').split(',') if c.strip()]
 MEAL_SLOTS = int(os.environ.get('MEAL_SLOTS', '5'))
 
+# HTMX responses for toggle_meal; there are only two
+TOGGLE_DONE_HTML = '<span class="toggle done">✓</span>'
+TOGGLE_UNDONE_HTML = '<span class="toggle">○</span>'
+
+# Part of recipe page ETags so a restart (e.g. after a template change) invalidates them
+ETAG_SALT = format(time.time_ns(), 'x')
+
 app.jinja_env.filters['format_amount'] = format_amount
 app.jinja_env.globals['all_ingredients'] = all_ingredients
 
+init_db()
+start_recipe_watcher(RECIPES_PATH)
+
+
+def get_recipes_snapshot():
+    """Recipe snapshot, fixed for the rest of the request so every helper sees the same recipes."""
+    snapshot = getattr(g, '_recipes', None)
+    if snapshot is None:
+        snapshot = g._recipes = recipes_snapshot(RECIPES_PATH)
+    return snapshot
+
 
 def get_recipes_dict():
-    """Load recipes as a dict keyed by slug."""
-    recipes = load_all_recipes(RECIPES_PATH)
-    return {r.slug: r for r in recipes}
+    """Recipes as a read-only dict keyed by slug."""
+    return get_recipes_snapshot().by_slug
+
 
+def get_recipes_sorted():
+    """Recipes as a tuple sorted by title."""
+    return get_recipes_snapshot().by_title
 
+
+@lru_cache(maxsize=1024)
+def parse_date(iso: str) -> date:
+    """date.fromisoformat, memoized since the same meal dates repeat on every page."""
+    return date.fromisoformat(iso)
+
+
+@lru_cache(maxsize=1024)
 def format_date_fi(d: date) -> str:
     """Format date as Finnish weekday + date."""
     return f"{DAYS_FI[d.weekday()]} {d.day}.{d.month}."
@@ -66,7 +102,7 @@ def index():
     meals = []
     for meal in week_meals:
         recipe = recipes.get(meal['recipe_slug'])
-        meal_date = date.fromisoformat(meal['meal_date']) if meal['meal_date'] else None
+        meal_date = parse_date(meal['meal_date']) if meal['meal_date'] else None
         meals.append({
             'id': meal['id'],
             'recipe': recipe,
@@ -75,7 +111,7 @@ def index():
             'meal_date': meal_date,
             'meal_date_fi': format_date_fi(meal_date) if meal_date else None,
             'chef': meal['chef'],
-            'is_today': meal_date == today if meal_date else False
+            'is_today': meal_date == today
         })
 
     # Calculate prev/next week dates
@@ -127,7 +163,7 @@ def week_ics():
             continue  # Skip meals without a date
 
         recipe = recipes.get(meal['recipe_slug'])
-        meal_date = date.fromisoformat(meal['meal_date'])
+        meal_date = parse_date(meal['meal_date'])
 
         # Build event title
         title = recipe.title if recipe else meal['recipe_slug']
@@ -174,38 +210,56 @@ def toggle_meal(meal_id):
     """Toggle meal done status."""
     is_done = toggle_meal_done(meal_id)
     if request.headers.get('HX-Request'):
-        return f'<span class="toggle {"done" if is_done else ""}">{("✓" if is_done else "○")}</span>'
+        return TOGGLE_DONE_HTML if is_done else TOGGLE_UNDONE_HTML
     return redirect(url_for('index'))
 
 
 # ============ Recipes ============
 
+@lru_cache(maxsize=4)
+def _render_recipes(signature):
+    """Render the recipe list; the signature changes whenever a recipe file does."""
+    return render_template('recipes.html', recipes=get_recipes_sorted())
+
+
 @app.route('/recipes')
 def recipes():
     """List all recipes."""
-    all_recipes = load_all_recipes(RECIPES_PATH)
-    return render_template('recipes.html', recipes=all_recipes)
+    if '_flashes' in session:
+        # Flash messages are part of the page, so don't serve or cache those renders
+        return render_template('recipes.html', recipes=get_recipes_sorted())
+    return _render_recipes(get_recipes_snapshot().signature)
 
 
 @app.route('/recipe/<slug>')
 def recipe(slug):
     """View a single recipe."""
-    recipes = get_recipes_dict()
-    recipe = recipes.get(slug)
+    snapshot = get_recipes_snapshot()
+    recipe = snapshot.by_slug.get(slug)
     if not recipe:
         flash('Reseptia ei löydy', 'error')
         return redirect(url_for('recipes'))
-    return render_template('recipe.html', recipe=recipe)
+
+    if '_flashes' in session:
+        return render_template('recipe.html', recipe=recipe)
+
+    # Stamp of the same snapshot the page is rendered from
+    mtime_ns, size = snapshot.stamps_by_slug[slug]
+    etag = f'{mtime_ns:x}-{size:x}-{ETAG_SALT}'
+    if request.if_none_match.contains_weak(etag):
+        resp = make_response('', 304)
+    else:
+        resp = make_response(render_template('recipe.html', recipe=recipe))
+    resp.set_etag(etag)
+    resp.cache_control.max_age = 0
+    resp.cache_control.must_revalidate = True
+    return resp
 
 
 @app.route('/recipe/<slug>/edit', methods=['GET', 'POST'])
 def edit_recipe(slug):
     """Edit a recipe with structured form."""
-    filepath = None
-    for f in RECIPES_PATH.rglob('*.json'):
-        if f.stem == slug:
-            filepath = f
-            break
+    filepath = get_recipe_path(RECIPES_PATH, slug)
 
     if request.method == 'POST':
         raw = request.form.get('recipe_json', '')
@@ -219,7 +273,8 @@ def edit_recipe(slug):
             filepath = RECIPES_PATH / "arkiruuat" / f"{slug}.json"
 
         save_recipe(filepath, data)
-        sync()
+        start_sync()
+        refresh_recipes(RECIPES_PATH)
         flash('Resepti tallennettu', 'success')
         return redirect(url_for('recipe', slug=filepath.stem))
 
@@ -242,12 +297,7 @@ def new_recipe():
             flash('Anna reseptille nimi', 'error')
             return render_template('editor.html', slug='', recipe_data=None, is_new=True)
 
-        slug = slug.lower().replace(' ', '-')
-
-        filepath = RECIPES_PATH / "arkiruuat" / f"{slug}.json"
-        if filepath.exists():
-            flash('Samanniminen resepti on jo olemassa', 'error')
-            return render_template('editor.html', slug=slug, recipe_data=None, is_new=True)
+        slug = slug.lower().translate(SLUG_TRANS)
 
         try:
             data = json.loads(raw)
@@ -255,8 +305,13 @@ def new_recipe():
             flash('Virheellinen JSON', 'error')
             return render_template('editor.html', slug=slug, recipe_data=None, is_new=True)
 
-        save_recipe(filepath, data)
-        sync()
+        filepath = RECIPES_PATH / "arkiruuat" / f"{slug}.json"
+        if not save_recipe(filepath, data, exclusive=True):
+            flash('Samanniminen resepti on jo olemassa', 'error')
+            return render_template('editor.html', slug=slug, recipe_data=None, is_new=True)
+
+        start_sync()
+        refresh_recipes(RECIPES_PATH)
         flash('Resepti luotu', 'success')
         return redirect(url_for('recipe', slug=slug))
 
@@ -305,7 +360,7 @@ def template_detail(template_id):
     return render_template('template_detail.html',
         template=template,
         meals=meal_list,
-        all_recipes=list(recipes.values())
+        all_recipes=get_recipes_sorted()
     )
 
 
@@ -377,7 +432,7 @@ def week_setup():
     meals = []
     for meal in current_meals:
         recipe = recipes.get(meal['recipe_slug'])
-        meal_date = date.fromisoformat(meal['meal_date']) if meal['meal_date'] else None
+        meal_date = parse_date(meal['meal_date']) if meal['meal_date'] else None
         meals.append({
             'id': meal['id'],
             'recipe': recipe,
@@ -408,7 +463,7 @@ def week_setup():
         templates=all_templates,
         meals=meals,
         empty_slots=empty_slots,
-        all_recipes=list(recipes.values()),
+        all_recipes=get_recipes_sorted(),
         week_start=week_start,
         current_template_id=week.get('template_id'),
         date_options=date_options,
@@ -567,34 +622,32 @@ def shopping():
     recipes = get_recipes_dict()
 
     # Aggregate ingredients
-    ingredients = {}
+    ingredients = defaultdict(lambda: {'name': None, 'amounts': []})
     meal_list = []
 
     for meal in undone:
         recipe = recipes.get(meal['recipe_slug'])
         if recipe:
-            meal_date = date.fromisoformat(meal['meal_date']) if meal['meal_date'] else None
+            meal_date = parse_date(meal['meal_date']) if meal['meal_date'] else None
             meal_list.append({
                 'date_fi': format_date_fi(meal_date) if meal_date else 'Ei pvm',
                 'recipe': recipe,
                 'chef': meal['chef']
             })
             for ing in all_ingredients(recipe):
-                key = ing.name.lower()
-                amount_str = format_amount(ing.amount)
-                if key in ingredients:
-                    if amount_str and ingredients[key]['amount']:
-                        ingredients[key]['amount'] += f", {amount_str}"
-                    elif amount_str:
-                        ingredients[key]['amount'] = amount_str
-                else:
-                    ingredients[key] = {
-                        'name': ing.name,
-                        'amount': amount_str
-                    }
+                entry = ingredients[ing.name.lower()]
+                entry['name'] = entry['name'] or ing.name
+                amount_str = ing.formatted_amount
+                if amount_str:
+                    entry['amounts'].append(amount_str)
+
+    shopping_list = [
+        {'name': e['name'], 'amount': ', '.join(e['amounts'])}
+        for e in ingredients.values()
+    ]
 
     return render_template('shopping.html',
-        ingredients=sorted(ingredients.values(), key=lambda x: x['name']),
+        ingredients=sorted(shopping_list, key=lambda x: x['name']),
         meals=meal_list
     )
 
@@ -605,20 +658,25 @@ def shopping():
 def sync_page():
     """Git sync page."""
     status = get_status()
-    return render_template('sync.html', status=status)
+    return render_template('sync.html', status=status, sync_status=get_sync_status())
 
 
 @app.route('/sync/do', methods=['POST'])
 def do_sync():
-    """Perform git sync."""
-    result = sync()
-    if result['success']:
-        flash(result['message'], 'success')
+    """Start a git sync in the background."""
+    if start_sync():
+        flash('Synkronointi käynnistetty', 'success')
     else:
-        flash(result['message'], 'error')
+        flash('Synkronointi on jo käynnissä, uusi synkronointi jonossa', 'success')
     return redirect(url_for('sync_page'))
 
 
+@app.route('/sync/status')
+def sync_status():
+    """Background sync state, polled by the sync page."""
+    return jsonify(get_sync_status())
+
+
 # ============ Run ============
 
 if __name__ == '__main__':
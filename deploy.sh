@@ -17,7 +17,7 @@ rsync -avz --delete \
     --exclude 'venv' \
     --exclude '.venv' \
     --exclude '*.pyc' \
-    --exclude 'data.db' \
+    --exclude 'data.db*' \
     --exclude '.env' \
     --exclude '.claude' \
     --exclude '.serena' \
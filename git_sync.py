@@ -2,11 +2,20 @@
 Git sync helpers for recipe submodule.
 """
 import subprocess
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
 from datetime import datetime
 
 RECIPES_PATH = Path(__file__).parent / "reseptit"
 
+# Background syncs run one at a time on this worker
+_sync_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="git-sync")
+_sync_lock = threading.Lock()
+_current_sync: Future | None = None
+_sync_running = False  # set by start_sync, cleared by the worker, both under _sync_lock
+_sync_requested = False
+
 
 def run_git(*args) -> tuple[bool, str]:
     """Run a git command in the recipes directory."""
@@ -26,14 +35,48 @@ def run_git(*args) -> tuple[bool, str]:
         return False, str(e)
 
 
+def _status_files() -> list[str]:
+    """Changed files as porcelain-style lines, parsed from `git status --porcelain=v2 -z`.
+
+    Raises RuntimeError with git's stderr if the command fails.
+    """
+    result = subprocess.run(
+        ["git", "status", "--porcelain=v2", "-z"],
+        cwd=RECIPES_PATH,
+        capture_output=True,
+        timeout=30
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.decode(errors="replace").strip())
+
+    files = []
+    entries = iter(result.stdout.split(b"\0"))
+    for entry in entries:
+        if not entry:
+            continue
+        kind = entry[:1]
+        if kind == b"?":
+            files.append("?? " + entry[2:].decode(errors="replace"))
+            continue
+        if kind not in (b"1", b"2", b"u"):
+            continue
+        # "<kind> <XY> <sub> <modes/hashes...> [<score>] <path>", path last
+        fields = 8 if kind == b"1" else 9 if kind == b"2" else 10
+        parts = entry.split(b" ", fields)
+        code = parts[1].replace(b".", b" ").decode()
+        files.append(f"{code} {parts[fields].decode(errors='replace')}".strip())
+        if kind == b"2":
+            next(entries, None)  # original path of a rename/copy
+    return files
+
+
 def get_status() -> dict:
     """Get git status of recipes directory."""
-    success, output = run_git("status", "--porcelain")
-    
-    if not success:
-        return {"error": output, "has_changes": False, "files": []}
-    
-    files = [line.strip() for line in output.split('\n') if line.strip()]
+    try:
+        files = _status_files()
+    except (OSError, RuntimeError, subprocess.TimeoutExpired) as e:
+        return {"error": str(e) or "git status failed", "has_changes": False, "files": []}
+
     return {
         "has_changes": len(files) > 0,
         "files": files,
@@ -41,9 +84,27 @@ def get_status() -> dict:
     }
 
 
+def fetch() -> tuple[bool, str]:
+    """Fetch latest changes from remote."""
+    return run_git("fetch")
+
+
+def rebase() -> tuple[bool, str]:
+    """Rebase local commits onto the fetched upstream branch."""
+    return run_git("rebase", "@{upstream}")
+
+
+def _rebase_after_fetch(fetch_result: tuple[bool, str]) -> tuple[bool, str]:
+    fetch_ok, fetch_msg = fetch_result
+    if not fetch_ok:
+        return fetch_ok, fetch_msg
+    rebase_ok, rebase_msg = rebase()
+    return rebase_ok, "\n".join(m for m in (fetch_msg, rebase_msg) if m)
+
+
 def pull() -> tuple[bool, str]:
-    """Pull latest changes from remote."""
-    return run_git("pull", "--rebase")
+    """Pull latest changes from remote (fetch + rebase)."""
+    return _rebase_after_fetch(fetch())
 
 
 def sync() -> dict:
@@ -54,14 +115,19 @@ def sync() -> dict:
         "details": []
     }
     
-    # Check status first
-    status = get_status()
+    # Check status and fetch at the same time, they don't depend on each other
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        status_future = pool.submit(get_status)
+        fetch_future = pool.submit(fetch)
+        status = status_future.result()
+        fetch_result = fetch_future.result()
+
     if status.get("error"):
         result["message"] = f"Git error: {status['error']}"
         return result
     
     # Pull first
-    pull_ok, pull_msg = pull()
+    pull_ok, pull_msg = _rebase_after_fetch(fetch_result)
     result["details"].append(f"Pull: {pull_msg or 'OK'}")
     
     if not pull_ok and "conflict" in pull_msg.lower():
@@ -103,3 +169,58 @@ def sync() -> dict:
     result["success"] = True
     result["message"] = f"Synced {len(status['files'])} file(s)"
     return result
+
+
+def _sync_until_idle() -> dict:
+    """Run sync, again if more syncs were requested while it was running."""
+    global _sync_running, _sync_requested
+    while True:
+        try:
+            result = sync()
+        except BaseException:
+            with _sync_lock:
+                if not _sync_requested:
+                    _sync_running = False
+                    raise
+                # A follow-up was queued during the failed run, run it instead
+                _sync_requested = False
+            continue
+        with _sync_lock:
+            if not _sync_requested:
+                # Cleared together with the check, so a start_sync() after
+                # this point starts a new run instead of queueing onto this one
+                _sync_running = False
+                return result
+            _sync_requested = False
+
+
+def start_sync() -> bool:
+    """Start a sync in the background and return immediately.
+
+    If a sync is already running, another one is queued to run after it
+    (so fresh changes still get pushed) and False is returned.
+    """
+    global _current_sync, _sync_running, _sync_requested
+    with _sync_lock:
+        if _sync_running:
+            _sync_requested = True
+            return False
+        _sync_running = True
+        _current_sync = _sync_executor.submit(_sync_until_idle)
+        return True
+
+
+def get_sync_status() -> dict:
+    """State of the background sync: {"running": bool, "result": dict | None}."""
+    with _sync_lock:
+        future = _current_sync
+        running = _sync_running
+    if future is None:
+        return {"running": False, "result": None}
+    if running or not future.done():
+        return {"running": True, "result": None}
+    try:
+        result = future.result()
+    except Exception as e:
+        result = {"success": False, "message": f"Sync failed: {e}", "details": []}
+    return {"running": False, "result": result}
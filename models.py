@@ -1,44 +1,126 @@
 """
 SQLite database models for meal planning.
 """
+import os
 import sqlite3
+import threading
+from collections import OrderedDict
 from pathlib import Path
 from datetime import date, datetime, timedelta
 from contextlib import contextmanager
+from functools import lru_cache
 
 DATABASE_PATH = Path(__file__).parent / "data.db"
 
+# UPDATE ... RETURNING needs SQLite 3.35+
+HAS_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+# Stored in PRAGMA user_version; bump when init_db() gains new schema
+SCHEMA_VERSION = 2
+
+# Sorts undated meals last while staying usable by an index
+MEAL_DATE_SORT_COLUMN = "meal_date_sort TEXT GENERATED ALWAYS AS (COALESCE(meal_date, '9999-12-31')) VIRTUAL"
+
+
+# (today, its Monday) from the last get_week_start() call without a date
+_today_cache = (None, None)
+
 
 def get_week_start(d: date = None) -> date:
     """Get Monday of the week for a given date."""
+    global _today_cache
     if d is None:
-        d = date.today()
+        today = date.today()
+        if _today_cache[0] == today:
+            return _today_cache[1]
+        monday = today - timedelta(days=today.weekday())
+        _today_cache = (today, monday)
+        return monday
     return d - timedelta(days=d.weekday())
 
 
-def get_week_dates(week_start: date = None) -> list[date]:
+@lru_cache(maxsize=8)
+def _week_dates(week_start: date) -> tuple[date, ...]:
+    return tuple(week_start + timedelta(days=i) for i in range(7))
+
+
+def get_week_dates(week_start: date = None) -> tuple[date, ...]:
     """Get all dates (Mon-Sun) for a week."""
     if week_start is None:
         week_start = get_week_start()
-    return [week_start + timedelta(days=i) for i in range(7)]
+    return _week_dates(week_start)
+
+
+# One long-lived connection per thread (and per process, in case of fork)
+_local = threading.local()
+
+
+def get_connection() -> sqlite3.Connection:
+    """This thread's database connection, opened on first use."""
+    conn = getattr(_local, 'conn', None)
+    if conn is None or _local.pid != os.getpid():
+        # Autocommit mode: transactions are only opened by transaction()
+        conn = sqlite3.connect(DATABASE_PATH, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.executescript('''
+            PRAGMA journal_mode = WAL;
+            PRAGMA synchronous = NORMAL;
+            PRAGMA temp_store = MEMORY;
+            PRAGMA mmap_size = 268435456;
+            PRAGMA cache_size = -20000;
+        ''')
+        _local.conn = conn
+        _local.pid = os.getpid()
+    return conn
 
 
 @contextmanager
-def get_db():
-    """Database connection context manager."""
-    conn = sqlite3.connect(DATABASE_PATH)
-    conn.row_factory = sqlite3.Row
+def transaction(conn: sqlite3.Connection):
+    """BEGIN IMMEDIATE ... COMMIT on conn, rolled back on error.
+
+    Nested use joins the outer transaction, so callers can batch several
+    writes into one commit.
+    """
+    if conn.in_transaction:
+        yield conn
+        return
+    conn.execute('BEGIN IMMEDIATE')
     try:
         yield conn
-        conn.commit()
-    finally:
-        conn.close()
+        conn.execute('COMMIT')
+    except BaseException:
+        if conn.in_transaction:
+            conn.execute('ROLLBACK')
+        raise
+
+
+@contextmanager
+def get_db():
+    """Transaction on this thread's connection: commit on success, roll back on error."""
+    with transaction(get_connection()) as conn:
+        yield conn
 
 
 def init_db():
-    """Initialize database schema."""
-    with get_db() as conn:
-        conn.executescript('''
+    """Create or upgrade the database schema; cheap no-op once it's current."""
+    conn = get_connection()
+    if conn.execute('PRAGMA user_version').fetchone()[0] >= SCHEMA_VERSION:
+        return
+
+    # Migrate first: the indexes below need the new columns
+    migrate_db()
+
+    # Version 2 added meal_date_sort; week_meals tables created before it need the column
+    columns = {row[1] for row in conn.execute('PRAGMA table_xinfo(week_meals)').fetchall()}
+    add_sort_column = ''
+    if columns and 'meal_date_sort' not in columns:
+        add_sort_column = f'ALTER TABLE week_meals ADD COLUMN {MEAL_DATE_SORT_COLUMN};'
+
+    # executescript runs outside transaction(), so the script brings its own
+    try:
+        conn.executescript(f'''
+            BEGIN IMMEDIATE;
+
             -- Weekly meal plan templates
             CREATE TABLE IF NOT EXISTS templates (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -73,21 +155,45 @@ def init_db():
                 chef TEXT,
                 position INTEGER NOT NULL DEFAULT 0,
                 is_done BOOLEAN DEFAULT 0,
+                {MEAL_DATE_SORT_COLUMN},
                 FOREIGN KEY (week_id) REFERENCES active_week(id) ON DELETE CASCADE
             );
+            {add_sort_column}
+
+            -- Week and template lookups (active_week.week_start is covered by its UNIQUE index)
+            DROP INDEX IF EXISTS idx_week_meals_week_done;
+            CREATE INDEX idx_week_meals_week_done
+                ON week_meals(week_id, is_done, meal_date_sort, position);
+            CREATE INDEX IF NOT EXISTS idx_week_meals_week_sort
+                ON week_meals(week_id, meal_date_sort, position);
+            CREATE INDEX IF NOT EXISTS idx_template_meals_tpl_pos
+                ON template_meals(template_id, position, recipe_slug);
+
+            ANALYZE;
+            PRAGMA user_version = {SCHEMA_VERSION};
+
+            COMMIT;
         ''')
+    except BaseException:
+        if conn.in_transaction:
+            conn.execute('ROLLBACK')
+        raise
 
 
 def migrate_db():
     """Migrate old schema to new schema if needed, preserving data."""
-    with get_db() as conn:
-        # Check if old schema exists (has 'day' column in week_meals)
-        cursor = conn.execute("PRAGMA table_info(week_meals)")
-        columns = [row[1] for row in cursor.fetchall()]
+    conn = get_connection()
 
-        if 'day' in columns:
-            # Old schema detected, migrate with data preservation
+    # Check if old schema exists (has 'day' column in week_meals)
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(week_meals)").fetchall()]
+    if 'day' not in columns:
+        return False
 
+    # Old schema detected, migrate with data preservation. Everything runs in
+    # one transaction, so durability per statement isn't needed meanwhile.
+    conn.execute('PRAGMA synchronous = OFF')
+    try:
+        with get_db() as conn:
             # 1. Backup existing data
             old_template_meals = conn.execute('SELECT * FROM template_meals').fetchall()
             old_week_meals = conn.execute('SELECT * FROM week_meals').fetchall()
@@ -99,16 +205,17 @@ def migrate_db():
             conn.execute('DROP TABLE IF EXISTS template_meals')
             conn.execute('DROP TABLE IF EXISTS week_meals')
 
-            # 3. Create new tables
-            conn.executescript('''
+            # 3. Create new tables (not executescript, which would commit)
+            conn.execute('''
                 CREATE TABLE template_meals (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
                     template_id INTEGER NOT NULL,
                     recipe_slug TEXT NOT NULL,
                     position INTEGER NOT NULL DEFAULT 0,
                     FOREIGN KEY (template_id) REFERENCES templates(id) ON DELETE CASCADE
-                );
-
+                )
+            ''')
+            conn.execute(f'''
                 CREATE TABLE week_meals (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
                     week_id INTEGER NOT NULL,
@@ -117,52 +224,109 @@ def migrate_db():
                     chef TEXT,
                     position INTEGER NOT NULL DEFAULT 0,
                     is_done BOOLEAN DEFAULT 0,
+                    {MEAL_DATE_SORT_COLUMN},
                     FOREIGN KEY (week_id) REFERENCES active_week(id) ON DELETE CASCADE
-                );
+                )
             ''')
 
             # 4. Migrate template_meals (use day as position)
-            for meal in old_template_meals:
-                conn.execute(
-                    'INSERT INTO template_meals (template_id, recipe_slug, position) VALUES (?, ?, ?)',
-                    (meal['template_id'], meal['recipe_slug'], meal['day'])
-                )
+            conn.executemany(
+                'INSERT INTO template_meals (template_id, recipe_slug, position) VALUES (?, ?, ?)',
+                [(m['template_id'], m['recipe_slug'], m['day']) for m in old_template_meals]
+            )
 
             # 5. Migrate week_meals (convert day to meal_date)
+            week_rows = []
             for meal in old_week_meals:
                 week_start_str = weeks.get(meal['week_id'])
                 meal_date = None
                 if week_start_str:
                     week_start = date.fromisoformat(week_start_str)
                     meal_date = (week_start + timedelta(days=meal['day'])).isoformat()
+                week_rows.append((meal['week_id'], meal['recipe_slug'], meal_date, meal['day'], meal['is_done']))
+
+            conn.executemany(
+                'INSERT INTO week_meals (week_id, recipe_slug, meal_date, position, is_done) VALUES (?, ?, ?, ?, ?)',
+                week_rows
+            )
+    finally:
+        conn.execute('PRAGMA synchronous = NORMAL')
+
+    return True
 
-                conn.execute(
-                    'INSERT INTO week_meals (week_id, recipe_slug, meal_date, position, is_done) VALUES (?, ?, ?, ?, ?)',
-                    (meal['week_id'], meal['recipe_slug'], meal_date, meal['day'], meal['is_done'])
-                )
 
-            return True
-    return False
+# In-process read caches. Entries are keyed by the version they were read at,
+# so a read racing a write can only ever store a stale entry under a version
+# that is no longer looked up. Versions are bumped after the write commits.
+# Both are LRUs of at most _CACHE_SIZE entries.
+_CACHE_SIZE = 128
+_cache_lock = threading.Lock()
+_template_version = 0
+_template_cache: OrderedDict[tuple, object] = OrderedDict()
+_week_version = 0
+_week_cache: OrderedDict[tuple, dict] = OrderedDict()
+
+
+def _cache_get(cache: OrderedDict, key):
+    with _cache_lock:
+        value = cache.get(key)
+        if value is not None:
+            cache.move_to_end(key)
+        return value
+
+
+def _cache_put(cache: OrderedDict, key, value):
+    with _cache_lock:
+        cache[key] = value
+        cache.move_to_end(key)
+        if len(cache) > _CACHE_SIZE:
+            cache.popitem(last=False)
+
+
+def _templates_changed():
+    global _template_version
+    with _cache_lock:
+        _template_version += 1
+        _template_cache.clear()
+
+
+def _weeks_changed():
+    global _week_version
+    with _cache_lock:
+        _week_version += 1
+        _week_cache.clear()
 
 
 # Template functions
 def get_all_templates():
     """Get all meal plan templates."""
-    with get_db() as conn:
-        return conn.execute('SELECT * FROM templates ORDER BY name').fetchall()
+    key = (None, _template_version)
+    templates = _cache_get(_template_cache, key)
+    if templates is None:
+        templates = tuple(get_connection().execute('SELECT * FROM templates ORDER BY name').fetchall())
+        _cache_put(_template_cache, key, templates)
+    return templates
 
 
 def get_template(template_id: int):
     """Get a single template by ID."""
-    with get_db() as conn:
-        return conn.execute('SELECT * FROM templates WHERE id = ?', (template_id,)).fetchone()
+    key = (template_id, _template_version)
+    template = _cache_get(_template_cache, key)
+    if template is None:
+        template = get_connection().execute(
+            'SELECT * FROM templates WHERE id = ?', (template_id,)
+        ).fetchone()
+        if template is not None:  # unknown ids aren't cached
+            _cache_put(_template_cache, key, template)
+    return template
 
 
 def create_template(name: str) -> int:
     """Create a new template, return its ID."""
     with get_db() as conn:
         cursor = conn.execute('INSERT INTO templates (name) VALUES (?)', (name,))
-        return cursor.lastrowid
+    _templates_changed()
+    return cursor.lastrowid
 
 
 def update_template_name(template_id: int, new_name: str) -> bool:
@@ -172,22 +336,23 @@ def update_template_name(template_id: int, new_name: str) -> bool:
             'UPDATE templates SET name = ? WHERE id = ?',
             (new_name, template_id)
         )
-        return cursor.rowcount > 0
+    _templates_changed()
+    return cursor.rowcount > 0
 
 
 def delete_template(template_id: int):
     """Delete a template and its meals."""
     with get_db() as conn:
         conn.execute('DELETE FROM templates WHERE id = ?', (template_id,))
+    _templates_changed()
 
 
 def get_template_meals(template_id: int):
     """Get all meals for a template."""
-    with get_db() as conn:
-        return conn.execute(
-            'SELECT * FROM template_meals WHERE template_id = ? ORDER BY position',
-            (template_id,)
-        ).fetchall()
+    return get_connection().execute(
+        'SELECT * FROM template_meals WHERE template_id = ? ORDER BY position',
+        (template_id,)
+    ).fetchall()
 
 
 def add_template_meal(template_id: int, recipe_slug: str) -> int:
@@ -204,48 +369,55 @@ def add_template_meal(template_id: int, recipe_slug: str) -> int:
             'INSERT INTO template_meals (template_id, recipe_slug, position) VALUES (?, ?, ?)',
             (template_id, recipe_slug, position)
         )
-        return cursor.lastrowid
+    _templates_changed()
+    return cursor.lastrowid
 
 
 def remove_template_meal(template_meal_id: int):
     """Remove a meal from a template."""
     with get_db() as conn:
         conn.execute('DELETE FROM template_meals WHERE id = ?', (template_meal_id,))
+    _templates_changed()
 
 
 # Active week functions
+def _ensure_week_id(conn, week_start: date) -> int:
+    """Id of the active week starting on week_start, created if missing, on the caller's connection."""
+    row = conn.execute(
+        'SELECT id FROM active_week WHERE week_start = ?',
+        (week_start.isoformat(),)
+    ).fetchone()
+    if row:
+        return row['id']
+
+    cursor = conn.execute(
+        'INSERT INTO active_week (week_start) VALUES (?)',
+        (week_start.isoformat(),)
+    )
+    return cursor.lastrowid
+
+
 def get_or_create_active_week(week_start: date = None) -> dict:
     """Get or create the active week entry."""
     if week_start is None:
         week_start = get_week_start()
 
-    with get_db() as conn:
-        row = conn.execute(
-            'SELECT * FROM active_week WHERE week_start = ?',
-            (week_start.isoformat(),)
-        ).fetchone()
-
-        if row:
-            return dict(row)
-
-        cursor = conn.execute(
-            'INSERT INTO active_week (week_start) VALUES (?)',
-            (week_start.isoformat(),)
-        )
-        return {
-            'id': cursor.lastrowid,
-            'week_start': week_start.isoformat(),
-            'template_id': None
-        }
+    key = (week_start.isoformat(), _week_version)
+    week = _cache_get(_week_cache, key)
+    if week is None:
+        with get_db() as conn:
+            week_id = _ensure_week_id(conn, week_start)
+            week = dict(conn.execute('SELECT * FROM active_week WHERE id = ?', (week_id,)).fetchone())
+        _cache_put(_week_cache, key, week)
+    return dict(week)
 
 
 def get_all_weeks() -> list:
     """Get all weeks, sorted by week_start descending."""
-    with get_db() as conn:
-        rows = conn.execute(
-            'SELECT * FROM active_week ORDER BY week_start DESC'
-        ).fetchall()
-        return [dict(row) for row in rows]
+    rows = get_connection().execute(
+        'SELECT * FROM active_week ORDER BY week_start DESC'
+    ).fetchall()
+    return [dict(row) for row in rows]
 
 
 def apply_template_to_week(template_id: int, week_start: date = None):
@@ -253,10 +425,27 @@ def apply_template_to_week(template_id: int, week_start: date = None):
     if week_start is None:
         week_start = get_week_start()
 
-    week = get_or_create_active_week(week_start)
-    week_id = week['id']
-
     with get_db() as conn:
+        week_id = _ensure_week_id(conn, week_start)
+
+        # Re-applying the same template to an untouched week changes nothing
+        current_template = conn.execute(
+            'SELECT template_id FROM active_week WHERE id = ?', (week_id,)
+        ).fetchone()['template_id']
+        if current_template == template_id:
+            week = conn.execute(
+                'SELECT recipe_slug, position, meal_date, chef, is_done FROM week_meals'
+                ' WHERE week_id = ? ORDER BY position, recipe_slug',
+                (week_id,)
+            ).fetchall()
+            template = conn.execute(
+                'SELECT recipe_slug, position, NULL, NULL, 0 FROM template_meals'
+                ' WHERE template_id = ? ORDER BY position, recipe_slug',
+                (template_id,)
+            ).fetchall()
+            if list(map(tuple, week)) == list(map(tuple, template)):
+                return
+
         # Clear existing meals
         conn.execute('DELETE FROM week_meals WHERE week_id = ?', (week_id,))
 
@@ -272,6 +461,7 @@ def apply_template_to_week(template_id: int, week_start: date = None):
             'UPDATE active_week SET template_id = ? WHERE id = ?',
             (template_id, week_id)
         )
+    _weeks_changed()
 
 
 def get_week_meals(week_start: date = None):
@@ -279,13 +469,12 @@ def get_week_meals(week_start: date = None):
     if week_start is None:
         week_start = get_week_start()
 
-    week = get_or_create_active_week(week_start)
-
     with get_db() as conn:
+        week_id = _ensure_week_id(conn, week_start)
         return conn.execute(
             '''SELECT * FROM week_meals WHERE week_id = ?
-               ORDER BY meal_date IS NULL, meal_date, position''',
-            (week['id'],)
+               ORDER BY meal_date_sort, position''',
+            (week_id,)
         ).fetchall()
 
 
@@ -294,19 +483,15 @@ def add_week_meal(recipe_slug: str, meal_date: date = None, chef: str = None, we
     if week_start is None:
         week_start = get_week_start()
 
-    week = get_or_create_active_week(week_start)
-
     with get_db() as conn:
-        # Get next position
-        row = conn.execute(
-            'SELECT COALESCE(MAX(position), -1) + 1 as next_pos FROM week_meals WHERE week_id = ?',
-            (week['id'],)
-        ).fetchone()
-        position = row['next_pos']
+        week_id = _ensure_week_id(conn, week_start)
 
+        # Insert at the next free position
         cursor = conn.execute(
-            'INSERT INTO week_meals (week_id, recipe_slug, meal_date, chef, position, is_done) VALUES (?, ?, ?, ?, ?, 0)',
-            (week['id'], recipe_slug, meal_date.isoformat() if meal_date else None, chef, position)
+            '''INSERT INTO week_meals (week_id, recipe_slug, meal_date, chef, position, is_done)
+               SELECT ?, ?, ?, ?, COALESCE(MAX(position), -1) + 1, 0
+               FROM week_meals WHERE week_id = ?''',
+            (week_id, recipe_slug, meal_date.isoformat() if meal_date else None, chef, week_id)
         )
         return cursor.lastrowid
 
@@ -347,14 +532,20 @@ def remove_week_meal(meal_id: int):
 def toggle_meal_done(meal_id: int) -> bool:
     """Toggle the is_done status of a meal, return new status."""
     with get_db() as conn:
-        conn.execute(
-            'UPDATE week_meals SET is_done = NOT is_done WHERE id = ?',
-            (meal_id,)
-        )
-        row = conn.execute(
-            'SELECT is_done FROM week_meals WHERE id = ?',
-            (meal_id,)
-        ).fetchone()
+        if HAS_RETURNING:
+            row = conn.execute(
+                'UPDATE week_meals SET is_done = NOT is_done WHERE id = ? RETURNING is_done',
+                (meal_id,)
+            ).fetchone()
+        else:
+            conn.execute(
+                'UPDATE week_meals SET is_done = NOT is_done WHERE id = ?',
+                (meal_id,)
+            )
+            row = conn.execute(
+                'SELECT is_done FROM week_meals WHERE id = ?',
+                (meal_id,)
+            ).fetchone()
         return bool(row['is_done']) if row else False
 
 
@@ -363,16 +554,11 @@ def get_undone_meals(week_start: date = None):
     if week_start is None:
         week_start = get_week_start()
 
-    week = get_or_create_active_week(week_start)
-
     with get_db() as conn:
+        week_id = _ensure_week_id(conn, week_start)
         return conn.execute(
             '''SELECT * FROM week_meals WHERE week_id = ? AND is_done = 0
-               ORDER BY meal_date IS NULL, meal_date, position''',
-            (week['id'],)
+               ORDER BY meal_date_sort, position''',
+            (week_id,)
         ).fetchall()
 
-
-# Initialize and migrate on import
-init_db()
-migrate_db()
@@ -2,42 +2,94 @@
 Recipe loading and saving for JSON-based recipe format.
 """
 import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
 from pathlib import Path
+from types import MappingProxyType
 
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:  # optional C parser, stdlib json works the same
+    _json_loads = json.loads
 
-@dataclass
+
+@dataclass(slots=True, frozen=True)
 class Ingredient:
     name: str
     amount: list = field(default_factory=list)  # [value, unit] or []
+    formatted_amount: str = field(init=False, repr=False, compare=False)  # format_amount(amount)
+
+    def __post_init__(self):
+        object.__setattr__(self, "formatted_amount", format_amount(self.amount))
 
     def __str__(self):
-        if self.amount:
-            return f"{self.name} ({' '.join(self.amount)})"
+        if self.formatted_amount:
+            return f"{self.name} ({self.formatted_amount})"
         return self.name
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class Phase:
     description: str
     ingredients: list = field(default_factory=list)  # indices into ingredient list
     time: list | None = None  # [value, unit] or None
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class Section:
     title: str
     ingredients: list = field(default_factory=list)  # [Ingredient]
     phases: list = field(default_factory=list)  # [Phase]
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class Recipe:
     slug: str
     title: str
     ingredients: list = field(default_factory=list)  # [Ingredient]
     phases: list = field(default_factory=list)  # [Phase]
     sections: list = field(default_factory=list)  # [Section]
+    flat_ingredients: list = field(init=False, repr=False, compare=False)  # [Ingredient]
+
+    def __post_init__(self):
+        if self.sections:
+            flat = [i for s in self.sections for i in s.ingredients]
+        else:
+            flat = self.ingredients
+        object.__setattr__(self, "flat_ingredients", flat)
+
+
+@dataclass(frozen=True)
+class RecipeSnapshot:
+    signature: frozenset  # {(path, stamp)} the snapshot was built from
+    by_slug: MappingProxyType  # read-only {slug: Recipe}
+    by_title: tuple  # (Recipe) sorted by title
+    stamps_by_slug: MappingProxyType  # read-only {slug: (mtime_ns, size)} of the file each recipe came from
+
+
+# Parsed recipes keyed by file path, with the (mtime_ns, size) stamp of the file they were parsed from
+_RECIPE_CACHE: dict[str, tuple[tuple[int, int], Recipe]] = {}
+
+# Recipe slug -> file path, rebuilt when files are added or removed
+_SLUG_INDEX: dict[str, str] = {}
+
+# Recipes dir -> current RecipeSnapshot, refreshed by the watcher thread
+_SNAPSHOTS: dict[str, RecipeSnapshot] = {}
+
+# Threads used to parse recipes on a cold cache; file reads release the GIL
+_PARSE_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+
+# Guards the caches above, which are shared by request threads and the watcher
+_lock = threading.RLock()
+
+# Process umask, read once at import (os.umask can only be read by setting it)
+_UMASK = os.umask(0)
+os.umask(_UMASK)
 
 
 def _parse_ingredients(raw_list):
@@ -56,10 +108,14 @@ def _parse_phases(raw_list):
     return phases
 
 
-def load_recipe(filepath: Path) -> Recipe:
-    """Load a recipe from a .json file."""
-    data = json.loads(filepath.read_text(encoding="utf-8"))
-    slug = filepath.stem
+def _slug_of(path: str) -> str:
+    return os.path.basename(path)[:-len(".json")]
+
+
+def _parse_recipe_file(path: str) -> Recipe:
+    with open(path, "rb") as f:
+        data = _json_loads(f.read())
+    slug = _slug_of(path)
 
     if "sections" in data:
         sections = []
@@ -79,22 +135,200 @@ def load_recipe(filepath: Path) -> Recipe:
         )
 
 
-def load_all_recipes(recipes_dir: Path) -> list[Recipe]:
-    """Load all .json recipes from a directory (recursive)."""
-    recipes = []
-    for json_file in recipes_dir.rglob("*.json"):
+def _cached_recipe(path: str, stamp: tuple[int, int]) -> Recipe:
+    """Return the cached recipe for path, parsing it again if its (mtime_ns, size) changed."""
+    cached = _RECIPE_CACHE.get(path)
+    if cached and cached[0] == stamp:
+        return cached[1]
+    recipe = _parse_recipe_file(path)
+    with _lock:
+        _RECIPE_CACHE[path] = (stamp, recipe)
+    return recipe
+
+
+def load_recipe(filepath: Path) -> Recipe:
+    """Load a recipe from a .json file."""
+    st = filepath.stat()
+    return _cached_recipe(os.fspath(filepath), (st.st_mtime_ns, st.st_size))
+
+
+def _iter_recipe_files(root: Path):
+    """Yield (path, (mtime_ns, size)) for every .json file under root using os.scandir."""
+    stack = [os.fspath(root)]
+    while stack:
         try:
-            recipe = load_recipe(json_file)
-            recipes.append(recipe)
+            it = os.scandir(stack.pop())
+        except OSError:
+            continue
+        with it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    if not entry.name.startswith("."):
+                        stack.append(entry.path)
+                elif entry.name.endswith(".json") and entry.is_file():
+                    st = entry.stat()
+                    yield entry.path, (st.st_mtime_ns, st.st_size)
+
+
+def _rebuild_slug_index(paths):
+    global _SLUG_INDEX
+    _SLUG_INDEX = {_slug_of(p): p for p in paths}
+
+
+def get_recipe_path(recipes_dir: Path, slug: str) -> Path | None:
+    """Find the .json file for a recipe slug, or None if it doesn't exist."""
+    path = _SLUG_INDEX.get(slug)
+    if path is None or not os.path.isfile(path):
+        _rebuild_slug_index(p for p, _ in _iter_recipe_files(recipes_dir))
+        path = _SLUG_INDEX.get(slug)
+    return Path(path) if path else None
+
+
+def _tree_signature(recipes_dir: Path) -> frozenset:
+    """(path, stamp) of every recipe file; changes whenever a recipe is edited, added or renamed."""
+    return frozenset(_iter_recipe_files(recipes_dir))
+
+
+def _try_parse(path: str) -> Recipe | None:
+    try:
+        return _parse_recipe_file(path)
+    except Exception:
+        return None  # reported when iter_recipes tries the file again
+
+
+def iter_recipes(recipes_dir: Path, files=None):
+    """Yield all .json recipes from a directory (recursive), in no particular order.
+
+    Files whose mtime hasn't changed since the last walk are served from
+    the in-memory cache instead of being parsed again. `files` may be an
+    already collected iterable of (path, stamp) to avoid walking again.
+    """
+    files = list(_iter_recipe_files(recipes_dir) if files is None else files)
+    seen = {path for path, _ in files}
+    added = any(path not in _RECIPE_CACHE for path in seen)
+
+    # Parse changed files in parallel first, so the loop below only hits the cache
+    misses = [(p, stamp) for p, stamp in files if _RECIPE_CACHE.get(p, (None,))[0] != stamp]
+    if len(misses) > 1:
+        with ThreadPoolExecutor(max_workers=min(_PARSE_WORKERS, len(misses))) as pool:
+            parsed = list(pool.map(_try_parse, [p for p, _ in misses]))
+        with _lock:
+            for (path, stamp), recipe in zip(misses, parsed):
+                if recipe is not None:
+                    _RECIPE_CACHE[path] = (stamp, recipe)
+
+    for path, stamp in files:
+        try:
+            yield _cached_recipe(path, stamp)
         except Exception as e:
-            print(f"Error loading {json_file}: {e}")
-    return sorted(recipes, key=lambda r: r.title)
+            print(f"Error loading {path}: {e}")
+
+    # Drop entries for files that have been removed or renamed
+    prefix = os.path.join(os.fspath(recipes_dir), "")
+    with _lock:
+        removed = [p for p in _RECIPE_CACHE if p.startswith(prefix) and p not in seen]
+        for path in removed:
+            del _RECIPE_CACHE[path]
+
+        if added or removed:
+            _rebuild_slug_index(seen)
+
+
+def load_all_recipes(recipes_dir: Path) -> list[Recipe]:
+    """Load all .json recipes from a directory (recursive), sorted by title."""
+    return sorted(iter_recipes(recipes_dir), key=lambda r: r.title)
+
 
+def refresh_recipes(recipes_dir: Path) -> RecipeSnapshot:
+    """Reload the recipe snapshot for a directory if any file changed, and return it."""
+    key = os.fspath(recipes_dir)
+    signature = _tree_signature(recipes_dir)
+    with _lock:
+        snapshot = _SNAPSHOTS.get(key)
+        if snapshot is None or snapshot.signature != signature:
+            # Warm the cache, then pair each recipe with the stamp it was parsed at
+            for _ in iter_recipes(recipes_dir, signature):
+                pass
+            entries = sorted(
+                (_RECIPE_CACHE[path] for path, stamp in signature
+                 if _RECIPE_CACHE.get(path, (None,))[0] == stamp),
+                key=lambda e: e[1].title,
+            )
+            by_title = tuple(r for _, r in entries)
+            snapshot = _SNAPSHOTS[key] = RecipeSnapshot(
+                signature=signature,
+                by_slug=MappingProxyType({r.slug: r for _, r in entries}),
+                by_title=by_title,
+                stamps_by_slug=MappingProxyType({r.slug: stamp for stamp, r in entries}),
+            )
+    return snapshot
 
-def save_recipe(filepath: Path, recipe_dict: dict):
-    """Write recipe dict as JSON."""
+
+def recipes_snapshot(recipes_dir: Path) -> RecipeSnapshot:
+    """Current recipe snapshot for a directory without touching the disk.
+
+    The first call for a directory loads it synchronously; after that the
+    watcher thread keeps it up to date.
+    """
+    snapshot = _SNAPSHOTS.get(os.fspath(recipes_dir))
+    if snapshot is None:
+        snapshot = refresh_recipes(recipes_dir)
+    return snapshot
+
+
+def start_recipe_watcher(recipes_dir: Path, interval: float = 2.0) -> threading.Thread:
+    """Refresh the recipe snapshot every `interval` seconds from a daemon thread."""
+    def watch():
+        while True:
+            time.sleep(interval)
+            try:
+                refresh_recipes(recipes_dir)
+            except Exception as e:
+                print(f"Error refreshing recipes: {e}")
+
+    thread = threading.Thread(target=watch, name="recipe-watcher", daemon=True)
+    thread.start()
+    return thread
+
+
+def save_recipe(filepath: Path, recipe_dict: dict, exclusive: bool = False) -> bool:
+    """Write recipe dict as JSON.
+
+    With exclusive=True the file is only created if it doesn't exist yet;
+    returns False if it already did. Otherwise the file is replaced
+    atomically, and left untouched if its content wouldn't change.
+    """
+    content = (json.dumps(recipe_dict, ensure_ascii=False, indent=2) + "\n").encode("utf-8")
     filepath.parent.mkdir(parents=True, exist_ok=True)
-    filepath.write_text(json.dumps(recipe_dict, ensure_ascii=False, indent=2) + "\n", encoding="utf-8")
+    if exclusive:
+        try:
+            with filepath.open("xb") as f:
+                f.write(content)
+        except FileExistsError:
+            return False
+        return True
+
+    try:
+        if filepath.read_bytes() == content:
+            return True
+        mode = filepath.stat().st_mode & 0o777
+    except FileNotFoundError:
+        mode = 0o666 & ~_UMASK  # what a plain open() would have created
+
+    # Unique temp file per save, so concurrent saves never share one
+    fd, tmp_path = tempfile.mkstemp(dir=filepath.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, mode)  # mkstemp creates files as 0600
+        os.replace(tmp_path, filepath)
+        tmp_path = None
+    finally:
+        if tmp_path is not None:
+            os.unlink(tmp_path)
+    return True
 
 
 def recipe_to_dict(recipe: Recipe) -> dict:
@@ -135,14 +369,14 @@ def recipe_to_dict(recipe: Recipe) -> dict:
 
 def all_ingredients(recipe: Recipe) -> list[Ingredient]:
     """Flat list of all ingredients across sections (or top-level)."""
-    if recipe.sections:
-        result = []
-        for s in recipe.sections:
-            result.extend(s.ingredients)
-        return result
-    return list(recipe.ingredients)
+    return recipe.flat_ingredients
 
 
 def format_amount(amount: list) -> str:
     """Format amount list as string: ['400', 'g'] -> '400 g', [] -> ''."""
-    return " ".join(amount) if amount else ""
+    n = len(amount) if amount else 0
+    if n == 2:
+        return f"{amount[0]} {amount[1]}"
+    if n == 1:
+        return amount[0]
+    return " ".join(amount) if n else ""